@@ -1,14 +1,24 @@
 import argparse
-from datetime import datetime
-from pytz import timezone
-from FIFO import StockStatement, Transaction, Report, to_nec_csv
+from functools import lru_cache
+from operator import itemgetter
+from datetime import datetime, timedelta, timezone
+from FIFO import StockStatement, Transaction, Report, to_nec_csv, US_EASTERN
 import csv
 import os
 import json
 from typing import List, Dict, Tuple
 
-def parse_float(f: str) -> float:
-	return 0 if len(f) == 0 else float(f)
+GMT8 = timezone(timedelta(hours=8))
+# Zone suffixes of the Trade Time column, and its formats for `strptime`.
+TIME_ZONES = (", GMT+8", ", US/Eastern")
+GMT8_TIME_FORMAT = "%Y-%m-%d\n%H:%M:%S, GMT+8"
+US_EASTERN_TIME_FORMAT = "%Y-%m-%d\n%H:%M:%S, US/Eastern"
+# Leading cells of a header row of the Trades table.
+TRADES_HEADER = ["Trades", "", "", ""]
+
+# `_float` binds the builtin as a local, this is called for every cost cell.
+def parse_float(f: str, _float=float) -> float:
+	return _float(f) if f else 0.0
 
 def proc_trade_header_row(row: List[str]) -> Dict[str, int]:
 	ret = dict()
@@ -17,61 +27,87 @@ def proc_trade_header_row(row: List[str]) -> Dict[str, int]:
 			ret[row[i]] = i
 	return ret
 
-def parse_trans(row: List[str], ti: Dict[str, int]) -> Transaction:
-	costs = 0
-	for i in range(ti["Amount"] + 1, ti["Realized P/L"]):
-		costs += parse_float(row[i])
-	costs = -costs
-	time = row[ti["Trade Time"]]
-	if "GMT+8" in time:
-		time = time.replace("GMT+8", "+0800")
-		time = datetime.strptime(time, "%Y-%m-%d\n%H:%M:%S, %z") \
-			.astimezone(timezone("US/Eastern"))
+# Rows of the same order or the same second share the time string, so the
+# parsed results are cached; the cache is bounded for unique-time inputs.
+@lru_cache(maxsize=8192)
+def parse_time(time: str) -> datetime:
+	# Exports normally use the layout "YYYY-MM-DD\nHH:MM:SS, <zone>", which
+	# is sliced directly. Other spacing or unpadded fields (e.g. files
+	# re-saved with "\r\n") fall back to `datetime.strptime`, which also
+	# raises `ValueError` for unsupported times.
+	zone = time[19:]
+	if zone in TIME_ZONES and time[4] == '-' and time[7] == '-' and \
+		time[10] == '\n' and time[13] == ':' and time[16] == ':' and \
+		(time[0:4] + time[5:7] + time[8:10] + time[11:13] + time[14:16] +
+		time[17:19]).isdigit():
+		gmt8 = zone == ", GMT+8"
+		date = datetime(int(time[0:4]), int(time[5:7]), int(time[8:10]),
+			int(time[11:13]), int(time[14:16]), int(time[17:19]))
 	else:
-		time = datetime.strptime(time, "%Y-%m-%d\n%H:%M:%S, US/Eastern") \
-			.astimezone(timezone("US/Eastern"))
-	return Transaction(float(row[ti["Quantity"]]),
-		float(row[ti["Trade Price"]]), costs, time)
+		gmt8 = "GMT+8" in time
+		date = datetime.strptime(time,
+			GMT8_TIME_FORMAT if gmt8 else US_EASTERN_TIME_FORMAT)
+	# Aware datetimes compare correctly across zones, so GMT+8 times keep
+	# their own offset; `Report` converts to US/Eastern when formatting.
+	# US/Eastern times are wall-clock times in that zone, `localize` picks
+	# the EST/EDT offset for them independent of the machine's time zone.
+	if gmt8:
+		return date.replace(tzinfo=GMT8)
+	return US_EASTERN.localize(date)
+
+# Resolve the columns used by `parse_trans` once per header row, as
+# (symbol, first cost, end of costs, quantity, trade price, trade time).
+def trade_columns(ti: Dict[str, int]) -> Tuple[int, int, int, int, int, int]:
+	return ti["Symbol"], ti["Amount"] + 1, ti["Realized P/L"], \
+		ti["Quantity"], ti["Trade Price"], ti["Trade Time"]
 
-def process_csv(csv_path: str, stmt: StockStatement, splits: Dict[str, List]) \
+def parse_trans(row: List[str], cost_start: int, cost_end: int,
+		qty_idx: int, price_idx: int, time_idx: int) -> Transaction:
+	costs = -sum(parse_float(row[i]) for i in range(cost_start, cost_end))
+	return Transaction(float(row[qty_idx]), float(row[price_idx]), costs,
+		parse_time(row[time_idx]))
+
+def process_csv(csv_path: str, stmt: StockStatement,
+	splits: Dict[datetime, List]) \
 	-> List[Tuple[str, Report]]:
 	with open(csv_path, 'r', newline='') as fd:
 		trades = csv.reader(fd)
 		it_trades = iter(trades)
-		while True:
-			th = next(it_trades)
-			if th[0] == "Trades" and th[1] == "" and th[2] == "" and th[3] == "":
+		for th in it_trades:
+			if th[:4] == TRADES_HEADER:
 				ti = proc_trade_header_row(th)
+				sym_idx, cost_start, cost_end, qty_idx, price_idx, time_idx = \
+					trade_columns(ti)
 				break
 		# `ti`: Convert header to index.
 		# `th`: Convert index to header.
 
 		all_transactions = []
-		while True:
-			try:
-				row = next(it_trades)
-			except StopIteration:
-				break
+		for row in it_trades:
 			# May encounter different column format.
-			if row[0] == "Trades" and \
-				row[1] == "" and row[2] == "" and row[3] == "":
+			if row[:4] == TRADES_HEADER:
 				ti = proc_trade_header_row(row)
 				th = row
+				sym_idx, cost_start, cost_end, qty_idx, price_idx, time_idx = \
+					trade_columns(ti)
 				continue
 			# Only process Trades and DATA row. Also we only process non-summary
 			# row, whose code is stored in the last summary row.
 			if row[0] != "Trades" or row[3] != "DATA":
 				continue
-			if len(row[ti["Symbol"]]) > 0:
-				cur_code = row[ti["Symbol"]]
+			if len(row[sym_idx]) > 0:
+				cur_code = row[sym_idx]
 			else:
+				trans = parse_trans(row,
+					cost_start, cost_end, qty_idx, price_idx, time_idx)
 				all_transactions.append(
-					(parse_trans(row, ti), cur_code, len(all_transactions)))
-		# If date is same, prioritize the row appearing first.
-		all_transactions.sort(key=lambda k: (k[0].date, k[2]))
+					(trans.date, len(all_transactions), trans, cur_code))
+		# If date is same, prioritize the row appearing first. Each file is
+		# sorted on its own, as its reports are collected after its trades.
+		all_transactions.sort(key=itemgetter(0, 1))
 
-		for trans, code, _ in all_transactions:
-			date = str(trans.date)
+		for _, _, trans, code in all_transactions:
+			date = trans.date
 			if date in splits:
 				stmt.split(splits[date][0], splits[date][1])
 				del splits[date]
@@ -105,7 +141,10 @@ if __name__ == "__main__":
 	# Parse JSON file of stock splits.
 	if args.splits is not None:
 		with open(args.splits, 'r') as fd:
-			splits = json.load(fd)
+			# Key the splits by aware datetime, which matches the parsed
+			# transaction time regardless of its zone.
+			splits = {datetime.fromisoformat(k): v
+				for k, v in json.load(fd).items()}
 	else:
 		splits = dict()
 
@@ -116,7 +155,7 @@ if __name__ == "__main__":
 		output_path = c[:-4] + ".nec.csv"
 		with open(output_path, 'w') as fd:
 			print("Storing results to:", output_path)
-			fd.write(to_nec_csv(reports, descs))
+			to_nec_csv(reports, descs, fd)
 		for code, report in reports:
 			total_sales += report.sales
 			total_costs += report.costs